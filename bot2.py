@@ -1,11 +1,24 @@
 #!/usr/bin/env python3
 import os
 import asyncio
+import functools
 import re
+import subprocess
 from pathlib import Path
+from urllib.parse import urlparse
 from pyrogram import Client, filters
+from pyrogram.errors import FloodWait, MessageNotModified
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 import yt_dlp
+from cachetools import TTLCache
+
+# uvloop's C fast paths cut per-callback overhead on every subprocess
+# read and Telegram round-trip; purely optional.
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
 
 # ---------------- Config ----------------
 API_ID = int(os.environ.get("API_ID") or 0)
@@ -15,10 +28,19 @@ BOT_TOKEN = os.environ.get("BOT_TOKEN")
 if not (API_ID and API_HASH and BOT_TOKEN):
     raise SystemExit("Set API_ID, API_HASH, and BOT_TOKEN in environment")
 
+# aria2c tuning: more parallel connections and no up-front file
+# allocation; overridable via env for per-host tuning.
+ARIA2_ARGS = os.environ.get(
+    "ARIA2_ARGS",
+    "-x 16 -s 16 -k 4M --file-allocation=none --console-log-level=warn --summary-interval=1",
+)
+
 BASE_DIR = Path(__file__).resolve().parent
-DOWNLOADS_DIR = BASE_DIR / "downloads"
+# The same bytes are written once and read back twice (merge, upload);
+# pointing this at tmpfs (e.g. /dev/shm/ytbot) keeps them off the disk.
+DOWNLOADS_DIR = Path(os.environ.get("DOWNLOADS_DIR_OVERRIDE") or BASE_DIR / "downloads")
 SESSION_DIR = BASE_DIR / "session_data"
-DOWNLOADS_DIR.mkdir(exist_ok=True)
+DOWNLOADS_DIR.mkdir(parents=True, exist_ok=True)
 SESSION_DIR.mkdir(exist_ok=True)
 
 app = Client(
@@ -29,29 +51,77 @@ app = Client(
     workdir=str(SESSION_DIR)
 )
 
+# Probe once at startup: use NVIDIA's hardware encoder when available.
+def _probe_nvenc():
+    try:
+        out = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-encoders"],
+            capture_output=True, text=True, timeout=10
+        ).stdout
+        return "h264_nvenc" in out
+    except Exception:
+        return False
+
+HAS_NVENC = _probe_nvenc()
+
+# Invariant command arguments, built once; per-request commands only
+# splice in the format, paths, and URL.
+_YTDLP_BASE = (
+    "yt-dlp",
+    "--no-warnings",
+    "--newline",
+    "--no-playlist",
+    "--merge-output-format", "mp4",
+    "--external-downloader", "aria2c",
+    "--external-downloader-args", ARIA2_ARGS,
+)
+# Decoded frames stay in system memory: keeping them on the GPU
+# (-hwaccel_output_format cuda) would break the -pix_fmt flag and the
+# software-encoded thumbnail output, which can't consume CUDA frames.
+_FFMPEG_CUDA_IN = ("ffmpeg", "-y", "-hwaccel", "cuda")
+_FFMPEG_COPY_ARGS = ("-c", "copy", "-movflags", "+faststart")
+_FFMPEG_NVENC_ARGS = (
+    "-c:v", "h264_nvenc", "-preset", "p4", "-rc", "vbr", "-cq", "23",
+    "-pix_fmt", "yuv420p", "-c:a", "aac", "-b:a", "128k",
+    "-movflags", "+faststart", "-threads", "0",
+)
+_FFMPEG_X264_ARGS = (
+    "-c:v", "libx264", "-crf", "23", "-preset", "fast",
+    "-pix_fmt", "yuv420p", "-c:a", "aac", "-b:a", "128k",
+    "-movflags", "+faststart", "-threads", "0",
+)
+_FFMPEG_THUMB_ARGS = ("-ss", "00:00:01", "-vframes", "1", "-an")
+
 QUALITY_OPTIONS = ["360", "480", "720"]
 QUALITY_EMOJIS = {"360": "🎥", "480": "📺", "720": "💎"}
 
 # ---------------- Temporary storage ----------------
-user_url = {}        # store URLs per user
-user_tasks = {}      # store active download tasks per user
+# TTL-bounded so entries for users who never come back (and references
+# to finished tasks) don't accumulate for the bot's whole lifetime.
+# Task entries must outlive the 6000 s subprocess timeout, or /cancel
+# stops finding downloads that are still legitimately running.
+user_url = TTLCache(maxsize=10_000, ttl=3600)    # store URLs per user
+user_tasks = TTLCache(maxsize=10_000, ttl=7200)  # store active download tasks per user
 
 # ---------------- Helpers ----------------
+# A width-20 bar only has 21 distinct renderings; look them up instead
+# of rebuilding the string on every progress tick.
+@functools.lru_cache(maxsize=None)
+def _bar_table(width):
+    return tuple("█" * i + "░" * (width - i) for i in range(width + 1))
+
 def create_progress_bar(percent, width=20):
     percent = max(0.0, min(100.0, percent))
-    filled = round(width * (percent / 100))
-    empty = width - filled
-    bar = "█" * filled + "░" * empty
-    return f"[{bar}] {percent:.1f}%"
+    return f"[{_bar_table(width)[round(width * (percent / 100))]}] {percent:.1f}%"
+
+_UNITS = ("B", "KB", "MB", "GB", "TB", "PB")
 
 def format_bytes(num):
     if not num:
         return "0 B"
-    for unit in ["B","KB","MB","GB","TB"]:
-        if num < 1024.0:
-            return f"{num:.2f} {unit}"
-        num /= 1024.0
-    return f"{num:.2f} PB"
+    # The unit index is just the bit length in steps of 10; no divide loop.
+    i = min((int(num).bit_length() - 1) // 10, 5)
+    return f"{num / (1 << (10 * i)):.2f} {_UNITS[i]}"
 
 def format_duration(seconds):
     try:
@@ -68,25 +138,65 @@ def format_duration(seconds):
 def clean_filename(s: str) -> str:
     return re.sub(r'[\\/:"*?<>|]+', "_", s)
 
+# Real host check instead of substring matching, which accepted junk
+# like notyoutube.com.evil and sent it on to a full extract_info.
+_YT_HOSTS = {"youtube.com", "www.youtube.com", "m.youtube.com", "youtu.be", "music.youtube.com"}
+
+def is_youtube_url(url):
+    try:
+        parsed = urlparse(url)
+        if not parsed.hostname:
+            # Pasted links often come without a scheme ("youtu.be/abc");
+            # urlparse treats those as all-path, so parse them as https.
+            parsed = urlparse("https://" + url)
+        return parsed.hostname in _YT_HOSTS
+    except Exception:
+        return False
+
+# One YoutubeDL for the process: __init__ registers every extractor,
+# which is too much work to repeat per request. The instance isn't
+# thread-safe, so extractions serialize on a lock.
+_YDL = yt_dlp.YoutubeDL({"quiet": True, "no_warnings": True, "skip_download": True})
+_YDL_LOCK = asyncio.Lock()
+
+async def extract_info(url):
+    async with _YDL_LOCK:
+        return await asyncio.to_thread(_YDL.extract_info, url, False)
+
+# Compiled once; the progress path sees hundreds of lines per download.
+_PCT_RE = re.compile(r"(\d{1,3}\.\d+)%.*?ETA\s+([0-9:]+)")
+_SPEED_RE = re.compile(r"at\s+([0-9.]+[KMG]?B/s)")
+
 async def run_subprocess(cmd, on_line=None, timeout=6000):
     proc = await asyncio.create_subprocess_exec(
         *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
     )
     assert proc.stdout is not None
+    # Read in large chunks under one overall deadline instead of a fresh
+    # future + timeout handle per line; split lines manually.
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    buf = b""
     while True:
         try:
-            line = await asyncio.wait_for(proc.stdout.readline(), timeout=timeout)
+            chunk = await asyncio.wait_for(
+                proc.stdout.read(65536), timeout=max(1, deadline - loop.time())
+            )
         except asyncio.TimeoutError:
             proc.kill()
             raise RuntimeError("Subprocess timed out (6000 s)")
-        if not line:
+        if not chunk:
             break
-        txt = line.decode(errors="ignore").rstrip()
-        if on_line:
-            try:
-                on_line(txt)
-            except Exception:
-                pass
+        buf += chunk
+        while b"\n" in buf:
+            line, buf = buf.split(b"\n", 1)
+            # Most lines carry no progress info; reject them on the raw
+            # bytes so they never pay for a decode or a regex pass.
+            if on_line and b"%" in line:
+                try:
+                    on_line(line)
+                except Exception:
+                    pass
     return await proc.wait()
 
 # ---------------- Bot Commands ----------------
@@ -113,7 +223,7 @@ async def cancel_download(_, message):
 @app.on_message(filters.text & ~filters.command(["start", "cancel"]))
 async def handle_url(_, message):
     url = message.text.strip()
-    if not ("youtube.com" in url or "youtu.be" in url):
+    if not is_youtube_url(url):
         await message.reply_text("❌ Please send a valid YouTube URL.")
         return
 
@@ -145,11 +255,11 @@ async def download_video(_, query):
 
     # ---------------- Extract info ----------------
     try:
-        with yt_dlp.YoutubeDL({"quiet": True, "no_warnings": True}) as ydl:
-            info = ydl.extract_info(url, download=False)
+        info = await extract_info(url)
     except Exception as e:
         await msg.edit_text(header + f"❌ Failed to extract video info.\n{e}")
         return
+    user_url.pop(user_id, None)
 
     title_raw = info.get("title", "video")
     duration = info.get("duration", 0)
@@ -157,6 +267,12 @@ async def download_video(_, query):
     final_path = DOWNLOADS_DIR / f"{clean_title}.mp4"
     temp_path = DOWNLOADS_DIR / f"{clean_title}_temp.mp4"
 
+    # Progress captions only vary in the bar/speed line; render the
+    # constant parts once per download instead of on every tick.
+    caption_head = f"╔═════════════════════\n\n 🎬 {title_raw}\n\n║ 📦 "
+    upload_head = "╔═════════════════════\n\n 🎬 Uploading\n\n║ "
+    caption_tail = "\n╚═════════════════════\n\n━━━━━✦ DEVU ❣️✦━━━━━"
+
     # ---------------- Integrated Final Design ----------------
     caption = (
         f"╔═════════════════════\n\n"
@@ -171,42 +287,61 @@ async def download_video(_, query):
 
     # ---------------- Integrated Final Design ----------------
     ytdlp_cmd = [
-        "yt-dlp",
+        *_YTDLP_BASE,
         "-f", f"bestvideo[height<={quality}]+bestaudio/best[height<={quality}]",
         "-o", str(temp_path),
-        "--no-warnings",
-        "--newline",
-        "--no-playlist",
-        "--merge-output-format", "mp4",
-        "--external-downloader", "aria2c",
-        "--external-downloader-args", "-x 4 -k 1M",
         url,
     ]
 
-    progress = {"pct": -1}
+    # parse_progress only records the latest state; a single throttled
+    # updater task ships it to Telegram, so aria2c's output cadence never
+    # spawns edit_text calls faster than the API tolerates.
+    progress = {"pct": 0, "speed": "?", "eta": "?", "dirty": False, "done": False}
     def parse_progress(line):
+        if b"ETA" not in line:
+            return
         # Robust regex for yt-dlp + aria2c output
-        m = re.search(r"(\d{1,3}\.\d+)%.*?ETA\s+([0-9:]+)", line)
-        speed_match = re.search(r"at\s+([0-9\.]+[KMG]?B/s)", line)
+        txt = line.decode(errors="ignore")
+        m = _PCT_RE.search(txt)
         if m:
-            pct = int(float(m.group(1)))
-            speed = speed_match.group(1) if speed_match else "?"
-            eta = m.group(2)
-            if pct % 5 == 0 and pct != progress["pct"]:
-                progress["pct"] = pct
-                asyncio.create_task(
-                    msg.edit_text(
-                        f"╔═════════════════════\n\n"
-                        f" 🎬 {title_raw}\n\n"
-                        f"║ 📦 {create_progress_bar(pct)}\n"
-                        f"║ ⏱ {speed} ETA {eta}\n"
-                        f"╚═════════════════════\n\n"
-                        f"━━━━━✦ DEVU ❣️✦━━━━━"
-                    )
-                )
+            speed_match = _SPEED_RE.search(txt)
+            progress["pct"] = int(float(m.group(1)))
+            progress["speed"] = speed_match.group(1) if speed_match else "?"
+            progress["eta"] = m.group(2)
+            progress["dirty"] = True
+
+    # Telegram often coalesces ticks into the same rendered caption;
+    # comparing against the last one skips the round-trip (and the
+    # MESSAGE_NOT_MODIFIED unwind) entirely.
+    last_caption = {"s": ""}
+
+    async def download_updater():
+        while not progress["done"]:
+            await asyncio.sleep(2)
+            if not progress["dirty"]:
+                continue
+            progress["dirty"] = False
+            text = (
+                caption_head
+                + create_progress_bar(progress["pct"])
+                + f"\n║ ⏱ {progress['speed']} ETA {progress['eta']}"
+                + caption_tail
+            )
+            if text == last_caption["s"]:
+                continue
+            last_caption["s"] = text
+            try:
+                await msg.edit_text(text)
+            except FloodWait as e:
+                await asyncio.sleep(e.value)
+            except MessageNotModified:
+                pass
+            except Exception:
+                pass
 
     # ---------------- Run download task with cancellation support ----------------
     async def run_download():
+        updater_task = asyncio.create_task(download_updater())
         try:
             ret = await run_subprocess(ytdlp_cmd, parse_progress)
             if ret != 0:
@@ -214,56 +349,70 @@ async def download_video(_, query):
                 return
         except asyncio.CancelledError:
             await msg.edit_message_text("❌ Download cancelled by user.")
-            try:
-                if temp_path.exists():
-                    os.remove(temp_path)
-            except:
-                pass
+            temp_path.unlink(missing_ok=True)
             return
+        finally:
+            progress["done"] = True
+            updater_task.cancel()
 
         # ---------------- Fix color + merge ----------------
         await msg.edit_text("🎨 Fixing video color & merging safely...")
-        ffmpeg_cmd = [
-            "ffmpeg", "-y",
-            "-i", str(temp_path),
-            "-c:v", "libx264",
-            "-crf", "23",
-            "-preset", "fast",
-            "-pix_fmt", "yuv420p",
-            "-c:a", "aac",
-            "-b:a", "128k",
-            str(final_path)
-        ]
-        proc = await asyncio.create_subprocess_exec(
-            *ffmpeg_cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        # yt-dlp already merged to mp4; when the pixel format is fine we
+        # only need a remux, which is IO-bound instead of a full re-encode.
+        proc_probe = await asyncio.create_subprocess_exec(
+            "ffprobe", "-v", "error", "-select_streams", "v:0",
+            "-show_entries", "stream=pix_fmt", "-of", "csv=p=0", str(temp_path),
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
         )
-        try:
-            await asyncio.wait_for(proc.communicate(), timeout=6000)
-        except asyncio.TimeoutError:
-            proc.kill()
+        probe_out, _probe_err = await proc_probe.communicate()
+        pix_fmt = probe_out.decode(errors="ignore").strip()
+
+        # Thumbnail rides along as a second output of the same invocation,
+        # so ffmpeg reads the source once instead of a separate full pass.
+        thumb_path = DOWNLOADS_DIR / f"{clean_title}_thumb.jpg"
+
+        use_nvenc = pix_fmt != "yuv420p" and HAS_NVENC
+        if pix_fmt == "yuv420p":
+            ffmpeg_cmd = ["ffmpeg", "-y", "-i", str(temp_path), *_FFMPEG_COPY_ARGS, str(final_path)]
+        elif use_nvenc:
+            ffmpeg_cmd = [*_FFMPEG_CUDA_IN, "-i", str(temp_path), *_FFMPEG_NVENC_ARGS, str(final_path)]
+        else:
+            ffmpeg_cmd = ["ffmpeg", "-y", "-i", str(temp_path), *_FFMPEG_X264_ARGS, str(final_path)]
+        ffmpeg_cmd += [*_FFMPEG_THUMB_ARGS, str(thumb_path)]
+
+        async def run_merge(cmd):
+            p = await asyncio.create_subprocess_exec(
+                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                await asyncio.wait_for(p.communicate(), timeout=6000)
+            except asyncio.TimeoutError:
+                p.kill()
+                return None
+            return p.returncode
+
+        ret = await run_merge(ffmpeg_cmd)
+        if ret not in (None, 0) and use_nvenc:
+            # The encoder being compiled in doesn't guarantee a usable
+            # CUDA device; fall back to libx264 as before.
+            ret = await run_merge(
+                ["ffmpeg", "-y", "-i", str(temp_path), *_FFMPEG_X264_ARGS, str(final_path),
+                 *_FFMPEG_THUMB_ARGS, str(thumb_path)]
+            )
+        if ret is None:
             await msg.edit_text("❌ FFmpeg merge timed out.")
             return
-        if proc.returncode != 0:
+        if ret != 0:
             await msg.edit_text("❌ FFmpeg merge failed.")
             return
 
-        # ---------------- Extract thumbnail ----------------
-        thumb_path = DOWNLOADS_DIR / f"{clean_title}_thumb.jpg"
-        ffmpeg_thumb_cmd = [
-            "ffmpeg", "-y",
-            "-i", str(final_path),
-            "-ss", "00:00:01",
-            "-vframes", "1",
-            str(thumb_path)
-        ]
-        proc_thumb = await asyncio.create_subprocess_exec(
-            *ffmpeg_thumb_cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-        )
-        await proc_thumb.communicate()
         if not thumb_path.exists():
             thumb_path = None
 
-        size = os.path.getsize(final_path) if os.path.exists(final_path) else 0
+        try:
+            size = os.path.getsize(final_path)
+        except OSError:
+            size = 0
         caption_final = (
             f"╔═════════════════════\n\n"
             f" 🎬 {title_raw}\n\n"
@@ -275,54 +424,88 @@ async def download_video(_, query):
         )
 
         # ---------------- Upload with progress ----------------
-        last_update = {"pct": -1}
+        upload = {"current": 0, "total": 0, "dirty": False, "done": False}
         async def progress_upload(current, total):
-            if not total:
-                return
-            pct = int((current / total) * 100)
-            if pct % 5 == 0 and pct != last_update["pct"]:
-                last_update["pct"] = pct
+            upload["current"] = current
+            upload["total"] = total
+            upload["dirty"] = True
+
+        async def upload_updater():
+            while not upload["done"]:
+                await asyncio.sleep(2)
+                if not upload["dirty"] or not upload["total"]:
+                    continue
+                upload["dirty"] = False
+                pct = int((upload["current"] / upload["total"]) * 100)
+                text = (
+                    upload_head
+                    + create_progress_bar(pct)
+                    + f"\n║ {format_bytes(upload['current'])}/{format_bytes(upload['total'])}"
+                    + caption_tail
+                )
+                if text == last_caption["s"]:
+                    continue
+                last_caption["s"] = text
                 try:
-                    bar = create_progress_bar(pct)
-                    await msg.edit_text(
-                        f"╔═════════════════════\n\n"
-                        f" 🎬 Uploading\n\n"
-                        f"║ {bar}\n"
-                        f"║ {format_bytes(current)}/{format_bytes(total)}\n"
-                        f"╚═════════════════════\n\n"
-                        f"━━━━━✦ DEVU ❣️✦━━━━━"
-                    )
+                    await msg.edit_text(text)
+                except FloodWait as e:
+                    await asyncio.sleep(e.value)
+                except MessageNotModified:
+                    pass
                 except Exception as e:
-                    if "MESSAGE_NOT_MODIFIED" not in str(e):
-                        print("Progress update error:", e)
+                    print("Progress update error:", e)
 
-        for attempt in range(3):
-            try:
-                await _.send_video(
-                    query.message.chat.id,
-                    video=str(final_path),
-                    caption=caption_final,
-                    supports_streaming=True,
-                    thumb=str(thumb_path) if thumb_path else None,
-                    progress=progress_upload,
-                    progress_args=(),
-                    duration=int(duration)
-                )
-                break
-            except Exception as e:
-                print(f"Upload attempt {attempt+1} failed:", e)
-                await asyncio.sleep(5)
-        else:
-            await msg.edit_text("❌ Upload failed after multiple retries.")
-            return
-
-        await msg.edit_text("✅ Uploaded successfully. Cleaning up...")
-        for f in (temp_path, final_path, thumb_path):
-            try:
-                if f:
-                    os.remove(f)
-            except:
-                pass
+        upload_task = asyncio.create_task(upload_updater())
+        try:
+            for attempt in range(3):
+                try:
+                    # pyrogram uploads in ~512 KiB chunks; a 4 MiB buffered
+                    # reader serves those from far fewer, larger preads.
+                    with open(final_path, "rb", buffering=4 * 1024 * 1024) as video_file:
+                        # Hint the kernel about the sequential read, and drop
+                        # the pages afterwards — the file is about to be
+                        # deleted, no point keeping it in the page cache.
+                        if hasattr(os, "posix_fadvise"):
+                            os.posix_fadvise(
+                                video_file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL
+                            )
+                        await _.send_video(
+                            query.message.chat.id,
+                            video=video_file,
+                            caption=caption_final,
+                            supports_streaming=True,
+                            thumb=str(thumb_path) if thumb_path else None,
+                            progress=progress_upload,
+                            progress_args=(),
+                            duration=int(duration)
+                        )
+                        if hasattr(os, "posix_fadvise"):
+                            os.posix_fadvise(
+                                video_file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED
+                            )
+                    break
+                except Exception as e:
+                    print(f"Upload attempt {attempt+1} failed:", e)
+                    await asyncio.sleep(5)
+            else:
+                await msg.edit_text("❌ Upload failed after multiple retries.")
+                return
+        finally:
+            # Also reached on CancelledError from /cancel mid-upload,
+            # which would otherwise leave the updater looping forever.
+            upload["done"] = True
+            upload_task.cancel()
+
+        # Unlinking multi-GB files can take a while; do it in a worker
+        # thread and don't hold up the final status message on it.
+        async def _cleanup(files):
+            def _do():
+                for f in files:
+                    if f:
+                        f.unlink(missing_ok=True)
+            await asyncio.to_thread(_do)
+
+        asyncio.create_task(_cleanup([temp_path, final_path, thumb_path]))
         await msg.edit_text("✅ Done. File deleted locally.")
 
     # ------
@@ -330,6 +513,13 @@ async def download_video(_, query):
     task = asyncio.create_task(run_download())
     user_tasks[user_id] = task
 
+    def _forget_task(t):
+        # Only drop our own registration; the user may have started a
+        # newer download that replaced this entry in the meantime.
+        if user_tasks.get(user_id) is t:
+            user_tasks.pop(user_id, None)
+    task.add_done_callback(_forget_task)
+
 # ---------------- Run Bot ----------------
 if __name__ == "__main__":
     print("Bot v5 starting... (Ultra-Stable 6000 s Timeout with aria2c + Thumbnail + Cancel + Mosaic Fix)")